@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from virtual_machine import clearInput, assemble, link, ObjectModule
+
+# Extension of object files, written next to the source file of each module
+OBJECT_EXTENSION = ".inobj"
+
+# Version of the object format and assembler, increase it whenever either changes so old object files are assembled again
+OBJECT_VERSION = 1
+
+def objectPath(sourcePath):
+    return os.path.splitext(sourcePath)[0] + OBJECT_EXTENSION
+
+def sourceHash(source):
+    return hashlib.sha256(source.encode()).hexdigest()
+
+# Object module of the source file if its object file is up to date, None otherwise
+def loadObject(sourcePath, source):
+    path = objectPath(sourcePath)
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except ValueError:
+        return None
+
+    if data.get("version") != OBJECT_VERSION:
+        return None
+
+    if data.get("sourceHash") != sourceHash(source):
+        return None
+
+    return ObjectModule.fromDict(data["module"])
+
+# Assemble a source file and write its object file
+# Runs in a worker process, so it only takes and returns picklable values
+def assembleFile(sourcePath, source):
+    module = assemble(clearInput(source))
+
+    if module.error is not None:
+        return None, module.error
+
+    data = {
+        "version": OBJECT_VERSION,
+        "sourceHash": sourceHash(source),
+        "module": module.toDict()
+    }
+
+    with open(objectPath(sourcePath), "w") as file:
+        json.dump(data, file)
+
+    return data["module"], None
+
+# Assemble (only modules changed since their object file was written) and link source files
+# The first file is placed at the start of program memory, so execution begins there
+def build(sourcePaths, workers = None):
+    modules = [None] * len(sourcePaths)
+
+    # Index in sourcePaths -> source code of modules to assemble
+    changed = {}
+
+    for index, sourcePath in enumerate(sourcePaths):
+        with open(sourcePath) as file:
+            source = file.read()
+
+        modules[index] = loadObject(sourcePath, source)
+
+        if modules[index] is None:
+            changed[index] = source
+
+    if len(changed) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {index: executor.submit(assembleFile, sourcePaths[index], source) for index, source in changed.items()}
+
+            results = {index: future.result() for index, future in futures.items()}
+    else:
+        # Not worth starting worker processes for a single module
+        results = {index: assembleFile(sourcePaths[index], source) for index, source in changed.items()}
+
+    for index, (data, error) in sorted(results.items()):
+        if data is None:
+            print(sourcePaths[index] + ": " + error)
+
+            return None
+
+        modules[index] = ObjectModule.fromDict(data)
+
+    programMemory, error = link(modules)
+
+    if programMemory is None:
+        print(error)
+
+    return programMemory
@@ -1,40 +1,63 @@
-from virtual_machine import clearInput, VM
+from virtual_machine import clearInput, Quota, VM
+from linker import build
+
+# Most instructions processed before a run is stopped (guards against programs that never end)
+MAX_INSTRUCTIONS = 1000000
 
 def main():
-    # Input for Inassembly source file
-    srcFile = input("Source file: ")
+    # Input for Inassembly source file (several files are assembled as modules and linked)
+    srcFiles = input("Source file(s): ").split()
+
+    # Instantiate the virtual machine
+    myVM = VM()
 
-    with open("src/" + srcFile) as file:
+    if len(srcFiles) == 1:
+        with open("src/" + srcFiles[0]) as file:
 
-        print("Clearing input...")
+            print("Clearing input...")
 
-        # Clear input (remove commentary and blank space)
-        code = clearInput(file.read())
+            # Clear input (remove commentary and blank space)
+            code = clearInput(file.read())
 
-        print("Done clearing.")
+            print("Done clearing.")
 
-        # Instantiate the virtual machine
-        myVM = VM()
+            print("Translating Inassembly to machine code...")
 
-        print("Translating Inassembly to machine code...")
+            # Translate Inassembly code into machine code
+            if not myVM.translate(code):
+                return
 
-        # Translate Inassembly code into machine code
-        if myVM.translate(code):
             print("Done translating.\n")
-            
-            myVM.show(True)
-            
-            option = input("Process step by step [y/n]? ")
 
-            # Process instructions
-            while myVM.process():
-                myVM.show()
+            file.close()
+    else:
+        print("Assembling and linking modules...")
+
+        # Assemble changed modules and lay them out in program memory
+        programMemory = build(["src/" + srcFile for srcFile in srcFiles])
+
+        if programMemory is None:
+            return
+
+        myVM.programMemory = programMemory
+
+        print("Done linking.\n")
+
+    myVM.show(True)
+
+    option = input("Process step by step [y/n]? ")
+
+    def step():
+        myVM.show()
+
+        if option == 'y':
+            input("Press enter to continue...")
 
-                if option == 'y':
-                    input("Press enter to continue...")
+    # Process instructions
+    stats = myVM.run(Quota(instructions = MAX_INSTRUCTIONS), step)
 
-        file.close()
+    if stats["reason"] != "halted":
+        print("Run stopped (" + stats["reason"] + ") after " + str(stats["instructionCount"]) + " instructions.")
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
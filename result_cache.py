@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from virtual_machine import VM
+
+# Hash of the assembled program (machine code in program memory)
+def programHash(programMemory):
+    return hashlib.sha256(",".join(str(word) for word in programMemory).encode()).hexdigest()
+
+
+class ResultCache:
+
+    # Default amount of results kept (least recently used results are evicted first)
+    CAPACITY = 256
+
+    # Default amount of changes made before the cache is written to its file
+    SAVE_EVERY = 32
+
+    def __init__(self, path = None, capacity = CAPACITY, saveEvery = SAVE_EVERY):
+
+        # File backing the cache (None keeps results only in memory)
+        self.path = path
+
+        self.capacity = capacity
+
+        # Changes not written to the file yet (the file is written every saveEvery changes and on flush)
+        self.saveEvery = saveEvery
+        self.unsaved = 0
+
+        # Result key -> recorded result, ordered from least to most recently used
+        self.results = OrderedDict()
+
+        # Program keys (program hash and machine options) of programs that can't be cached
+        self.uncacheable = set()
+
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as file:
+            data = json.load(file)
+
+        for key, result in data.get("results", []):
+            self.results[key] = result
+
+        self.uncacheable.update(data.get("uncacheable", []))
+
+        while len(self.results) > self.capacity:
+            self.results.popitem(last = False)
+
+    # Write the cache to its file if there are unsaved changes
+    def flush(self):
+        if self.path is None or self.unsaved == 0:
+            return
+
+        data = {
+            "results": list(self.results.items()),
+            "uncacheable": sorted(self.uncacheable)
+        }
+
+        # Write to a temporary file first so a crash never leaves a truncated cache behind
+        temporaryPath = self.path + ".tmp"
+
+        with open(temporaryPath, "w") as file:
+            json.dump(data, file)
+
+        os.replace(temporaryPath, self.path)
+
+        self.unsaved = 0
+
+    def _changed(self):
+        self.unsaved += 1
+
+        if self.unsaved >= self.saveEvery:
+            self.flush()
+
+    # Machine options that change the result of a run
+    def _options(self, options):
+        machineOptions = {
+            "registerBits": VM.ARCHITECTURE_SIZE,
+            "cacheLines": VM.CACHE_LINES,
+            "cacheBlock": VM.CACHE_BLOCK
+        }
+
+        if options:
+            machineOptions.update(options)
+
+        return machineOptions
+
+    def _programKey(self, digest, options):
+        return hashlib.sha256(json.dumps([digest, options], sort_keys = True).encode()).hexdigest()
+
+    def _resultKey(self, programKey, inputs):
+        return hashlib.sha256(json.dumps([programKey, inputs]).encode()).hexdigest()
+
+    # Recorded result of the program, or None if it was never run with any prefix of the inputs
+    # digest identifies the program (see programHash), callers that already have one can skip hashing it again
+    def get(self, programMemory, inputs, options = None, digest = None):
+        if digest is None:
+            digest = programHash(programMemory)
+
+        programKey = self._programKey(digest, self._options(options))
+
+        if programKey in self.uncacheable:
+            return None
+
+        inputs = [int(value) for value in inputs]
+
+        # A result is keyed by the inputs its run consumed, so any prefix of the given inputs may match
+        for consumed in range(len(inputs) + 1):
+            key = self._resultKey(programKey, inputs[:consumed])
+
+            if key in self.results:
+                self.results.move_to_end(key)
+
+                return self.results[key]
+
+        return None
+
+    # Record the result of a finished run
+    def put(self, programMemory, vm, options = None, digest = None):
+        if digest is None:
+            digest = programHash(programMemory)
+
+        programKey = self._programKey(digest, self._options(options))
+
+        if programKey in self.uncacheable:
+            return
+
+        if not vm.deterministic:
+            self.uncacheable.add(programKey)
+            self._changed()
+
+            return
+
+        # The run stopped because inputs ran out, a longer input sequence would behave differently
+        if vm.inputExhausted:
+            return
+
+        # Where a run stops on wall time differs from one run to another
+        if vm.stopReason == "timeQuota":
+            return
+
+        key = self._resultKey(programKey, vm.consumedInputs)
+
+        # Register numbers are kept as strings, the same way they are read back from the file
+        self.results[key] = {
+            "outputs": list(vm.outputs),
+            "registers": {str(register): data for register, data in vm.registers.items()},
+            "instructionCount": vm.instructionCount,
+            "dataWords": len(vm.dataMemory),
+            "error": vm.error,
+            "reason": vm.stopReason
+        }
+
+        self.results.move_to_end(key)
+
+        while len(self.results) > self.capacity:
+            self.results.popitem(last = False)
+
+        self._changed()
+
+    # Run the program with the given inputs, reusing a recorded result when possible
+    def run(self, programMemory, inputs, options = None, quota = None):
+
+        # Quotas change where a run stops, so they are part of the machine options
+        if quota is not None:
+            options = dict(options or {}, **quota.limits())
+
+        digest = programHash(programMemory)
+
+        result = self.get(programMemory, inputs, options, digest)
+
+        if result is not None:
+            registers = {int(register): data for register, data in result["registers"].items()}
+
+            return dict(result, registers = registers)
+
+        vm = VM(inputs, verbose = False)
+        vm.programMemory = list(programMemory)
+
+        vm.run(quota)
+
+        self.put(programMemory, vm, options, digest)
+
+        return {
+            "outputs": list(vm.outputs),
+            "registers": dict(vm.registers),
+            "instructionCount": vm.instructionCount,
+            "dataWords": len(vm.dataMemory),
+            "error": vm.error,
+            "reason": vm.stopReason
+        }
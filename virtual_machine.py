@@ -1,4 +1,5 @@
 import re
+import time
 
 MNEMONICS_TRANSLATION = {
     "add": 0,
@@ -77,6 +78,251 @@ def clearInput(input):
     return output
 
 
+# Regex to match label definition
+LABEL_DEFINITION_REGEX = re.compile("^([a-zA-Z_]+[a-zA-Z_0-9]*):\r?\n?$")
+
+# Regex to match label name (used by .export and .import directives)
+LABEL_NAME_REGEX = re.compile("^[a-zA-Z_]+[a-zA-Z_0-9]*$")
+
+# Largest value that fits in the 22-bit immediate/address field
+ADDRESS_MAX = 0x3FFFFF
+
+# Assembled module, with label references still to be resolved by the linker
+class ObjectModule:
+    def __init__(self):
+
+        # Machine code, with zeroes in place of label addresses
+        self.code = []
+
+        # Label -> address relative to the start of the module
+        self.labels = {}
+
+        # Labels visible to other modules and labels defined by other modules
+        self.exports = []
+        self.imports = []
+
+        # Label references, [address (index in code), string index which the address starts, label]
+        self.relocations = []
+
+        # Message of the error found while assembling, if any
+        self.error = None
+
+    def toDict(self):
+        return {
+            "code": self.code,
+            "labels": self.labels,
+            "exports": self.exports,
+            "imports": self.imports,
+            "relocations": self.relocations
+        }
+
+    @classmethod
+    def fromDict(cls, data):
+        module = cls()
+
+        module.code = data["code"]
+        module.labels = data["labels"]
+        module.exports = data["exports"]
+        module.imports = data["imports"]
+        module.relocations = data["relocations"]
+
+        return module
+
+# Translate source code of a module into an object module
+def assemble(original, architectureSize = 32):
+    module = ObjectModule()
+
+    # Translated instruction buffer
+    instructionTranslated = 0
+
+    # Bit shifting helper
+    shiftHelper = architectureSize
+
+    tokens = iter(original)
+
+    for data in tokens:
+
+        if data in (".export", ".import"):
+            # Directive, the next token is the label exported or imported
+            label = next(tokens, "")
+
+            if not LABEL_NAME_REGEX.match(label):
+                module.error = "Error [invalid " + data + " directive]"
+
+                return module
+
+            if data == ".export":
+                module.exports.append(label)
+            else:
+                module.imports.append(label)
+
+            continue
+
+        if data in MNEMONICS_TRANSLATION:
+            # Matched a mnemonic, translate to binary opcode and add to translated instruction buffer
+            opcode = MNEMONICS_TRANSLATION[data]
+
+            shiftHelper -= 4
+
+            instructionTranslated |= (opcode << shiftHelper)
+
+            # Padding in order to complete a 32-bit instruction
+            if opcode in INSTRUCTION_PADDING:
+                shiftHelper -= INSTRUCTION_PADDING[opcode]
+
+        elif data in REGISTERS_TRANSLATION:
+            # Matched a register, translate to binary register identification and add to translated instruction buffer
+            shiftHelper -= 3
+
+            instructionTranslated |= (REGISTERS_TRANSLATION[data] << shiftHelper)
+        else:
+            # Handling data that is neither a mnemonic nor a register
+            # That is, a possible immediate value to arithmetics purpose, address or label
+
+            try:
+                # https://stackoverflow.com/questions/209513/convert-hex-string-to-int-in-python
+                immediateData = int(data, 0)
+                shiftHelper -= 22
+
+                instructionTranslated |= (immediateData << shiftHelper)
+            except ValueError:
+                # Probably it's a label
+
+                if not LABEL_DEFINITION_REGEX.match(data):
+                    # It's either a label called in a jump or branch or a syntax error
+                    # Let's assume it's a label
+
+                    # The label address is only known after linking, so a dummy address is written for now
+                    shiftHelper -= 22
+
+                    module.relocations.append([len(module.code), shiftHelper, data])
+                else:
+                    # It's a label definition
+                    labelData = LABEL_DEFINITION_REGEX.search(data)
+                    label = labelData.group(1) 
+                    
+                    # Check if the label is already mapped
+                    if label in module.labels:
+                        module.error = "Error [label already defined]"
+
+                        return module
+                    
+                    module.labels[label] = len(module.code)
+
+        # If the instruction size limit is reached, store in module code and advance to the next instruction
+        if shiftHelper <= 0:
+            module.code.append(instructionTranslated)
+
+            shiftHelper = architectureSize
+            instructionTranslated = 0
+
+    for label in module.imports:
+        if label in module.labels:
+            module.error = "Error [imported label " + label + " is also defined]"
+
+            return module
+
+    for label in module.exports:
+        if label not in module.labels:
+            module.error = "Error [exported label " + label + " is not defined]"
+
+            return module
+
+    # If a label is neither defined nor imported, there is probably a syntax error (or a label definition is missing)
+    for relocation in module.relocations:
+        label = relocation[2]
+
+        if label not in module.labels and label not in module.imports:
+            module.error = "Error [syntax or label definition missing]"
+
+            return module
+
+    return module
+
+# Write the code of each module in program memory, one after the other, and resolve label addresses
+# Returns the program memory, or None and an error message
+def link(modules):
+    programMemory = []
+
+    # Address which each module starts in program memory
+    moduleBase = []
+
+    # Exported label -> absolute address
+    globalLabels = {}
+
+    for module in modules:
+        base = len(programMemory)
+
+        moduleBase.append(base)
+        programMemory.extend(module.code)
+
+        for label in module.exports:
+            if label in globalLabels:
+                return None, "Error [label " + label + " exported by more than one module]"
+
+            globalLabels[label] = base + module.labels[label]
+
+    for module, base in zip(modules, moduleBase):
+        for address, dummyAddressStart, label in module.relocations:
+            if label in module.labels:
+                labelAddress = base + module.labels[label]
+            elif label in globalLabels:
+                labelAddress = globalLabels[label]
+            else:
+                return None, "Error [imported label " + label + " is not exported by any module]"
+
+            if labelAddress > ADDRESS_MAX:
+                return None, "Error [label " + label + " address does not fit in 22 bits]"
+
+            # Replace dummy address with label address
+            programMemory[base + address] |= (labelAddress << dummyAddressStart)
+
+    return programMemory, None
+
+
+# Limits of a run, None means unlimited
+class Quota:
+
+    # Quotas are checked once every CHECK_INTERVAL instructions instead of after each instruction,
+    # so data memory may go over its quota by what this many instructions touch (a run over it is still reported as such)
+    # The output quota is exact, inout refuses to output once it is reached
+    # Wall time is not checked while waiting for standard input
+    CHECK_INTERVAL = 256
+
+    def __init__(self, instructions = None, seconds = None, dataWords = None, outputs = None, checkInterval = CHECK_INTERVAL):
+        self.instructions = instructions
+        self.seconds = seconds
+        self.dataWords = dataWords
+        self.outputs = outputs
+        self.checkInterval = checkInterval
+
+    # Limits that change where a run stops (wall time is left out, it differs from one run to another)
+    def limits(self):
+        return {
+            "instructions": self.instructions,
+            "dataWords": self.dataWords,
+            "outputs": self.outputs,
+            "checkInterval": self.checkInterval
+        }
+
+    # Reason to stop the run, or None if no quota is exceeded
+    # finished is set for runs that already stopped, which never go past the instruction quota
+    def exceeded(self, vm, elapsed, finished = False):
+        if not finished and self.instructions is not None and vm.instructionCount >= self.instructions:
+            return "instructionQuota"
+
+        if self.seconds is not None and elapsed >= self.seconds:
+            return "timeQuota"
+
+        if self.dataWords is not None and len(vm.dataMemory) > self.dataWords:
+            return "dataMemoryQuota"
+
+        if self.outputs is not None and len(vm.outputs) > self.outputs:
+            return "outputQuota"
+
+        return None
+
+
 # Cache line
 class Line:
     def __init__(self, blockSize):
@@ -96,7 +342,37 @@ class VM:
     # Cache columns (must be 2^something)
     CACHE_BLOCK = 4
 
-    def __init__(self):
+    def __init__(self, inputs = None, verbose = True):
+
+        # Print execution messages (cache hits, outputs and errors) to standard output
+        self.verbose = verbose
+
+        self.reset(inputs)
+
+    # Bring the virtual machine back to its initial state, so it can be reused for another run
+    def reset(self, inputs = None):
+
+        # Input values consumed by inout (None reads from standard input)
+        self.inputs = None if inputs is None else list(inputs)
+
+        # Execution record (inputs consumed, values printed and instructions processed)
+        self.consumedInputs = []
+        self.outputs = []
+        self.instructionCount = 0
+        self.inputExhausted = False
+
+        # Message of the error that stopped the run, if any
+        self.error = None
+
+        # Reason the last call to run stopped (see run)
+        self.stopReason = None
+
+        # Most values inout may output (set by run from its quota) and the quota inout stopped the run on
+        self.outputLimit = None
+        self.quotaReason = None
+
+        # Cleared when the run depends on state other than the program and its inputs
+        self.deterministic = True
 
         # Memory initialization
         self.programMemory = []
@@ -117,6 +393,24 @@ class VM:
             7: 0                     # Program Counter
         }
 
+    # Print an execution message
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+    # Record and print an error message
+    def _error(self, message):
+        self.error = message
+
+        self._log(message)
+
+    # Keep a value in the range of a signed register of ARCHITECTURE_SIZE bits (two's complement wrap around)
+    # Without it, repeated multiplications grow registers until a single instruction takes longer than any quota
+    def _wrap(self, value):
+        signBit = 1 << (self.ARCHITECTURE_SIZE - 1)
+
+        return ((value + signBit) & ((signBit << 1) - 1)) - signBit
+
     # Show Virtual Machine memory
     def show(self, printProgramMemory = False):
         if printProgramMemory:
@@ -159,119 +453,26 @@ class VM:
 
     # Translate source code into machine code
     def translate(self, original):
+        module = assemble(original, self.ARCHITECTURE_SIZE)
 
-        # Position which the next translated instruction will be stored in the program memory
-        programMemoryPointer = 0
-
-        # Translated instruction buffer
-        instructionTranslated = 0
-
-        # Bit shifting helper
-        shiftHelper = self.ARCHITECTURE_SIZE
-
-        # Regex to match label definition
-        labelRegex = re.compile("^([a-zA-Z_]+[a-zA-Z_0-9]*):\r?\n?$")
-
-        # Label mapping
-        labelMapping = {}
-
-        # Dictionary of instructions to be updated after a label is defined
-        instructionUpdate = {}
-
-        for data in original:
-
-            if data in MNEMONICS_TRANSLATION:
-                # Matched a mnemonic, translate to binary opcode and add to translated instruction buffer
-                opcode = MNEMONICS_TRANSLATION[data]
-
-                shiftHelper -= 4
-
-                instructionTranslated |= (opcode << shiftHelper)
-
-                # Padding in order to complete a 32-bit instruction
-                if opcode in INSTRUCTION_PADDING:
-                    shiftHelper -= INSTRUCTION_PADDING[opcode]
-
-            elif data in REGISTERS_TRANSLATION:
-                # Matched a register, translate to binary register identification and add to translated instruction buffer
-                shiftHelper -= 3
-
-                instructionTranslated |= (REGISTERS_TRANSLATION[data] << shiftHelper)
-            else:
-                # Handling data that is neither a mnemonic nor a register
-                # That is, a possible immediate value to arithmetics purpose, address or label
-
-                try:
-                    # https://stackoverflow.com/questions/209513/convert-hex-string-to-int-in-python
-                    immediateData = int(data, 0)
-                    shiftHelper -= 22
-
-                    instructionTranslated |= (immediateData << shiftHelper)
-                except ValueError:
-                    # Probably it's a label
-
-                    if not labelRegex.match(data):
-                        # It's either a label called in a jump or branch or a syntax error
-                        # Let's assume it's a label
-
-                        shiftHelper -= 22
-                        if data in labelMapping:
-                            # The supposed label is already mapped, let's write its address
-
-                            instructionTranslated |= (labelMapping[data] << shiftHelper)
-                        else:
-                            # The supposed label is not mapped yet, let's store the instruction address in order to update it later
-                            # While we can't update the instruction, it'll have a dummy address written instead of the label (maybe) 
-                            # future address
+        if module.error is None and module.imports:
+            # A single module has no other module to import labels from
+            module.error = "Error [syntax or label definition missing]"
 
-                            # label -> [(data), (data)]
-                            # 1 -> address (index in programMemory)
-                            # 2 -> string index which the address starts
+        if module.error is not None:
+            self._error(module.error)
 
-                            if data in instructionUpdate:
-                                instructionUpdate[data].append([programMemoryPointer, shiftHelper])
-                            else:
-                                instructionUpdate[data] = [[programMemoryPointer, shiftHelper]]
-                    else:
-                        # It's a label definition
-                        labelData = labelRegex.search(data)
-                        label = labelData.group(1) 
-                        
-                        # Check if the label is already mapped
-                        if label in labelMapping:
-                            print("Error [label already defined]")
-
-                            return False
-                        
-                        labelMapping[label] = programMemoryPointer
-
-                        # Check if there are any instructions to update with the label address
-                        if label in instructionUpdate:
-
-                            # Iterare through instructions to update and replace dummy address with label address
-                            for instructionData in instructionUpdate[label]:
-                                programMemoryAddress = instructionData[0]
-                                dummyAddressStart = instructionData[1]
-
-                                self.programMemory[programMemoryAddress] |= (programMemoryPointer << dummyAddressStart)
-
-                            del instructionUpdate[label]   
-
-            # If the instruction size limit is reached, store in program memory and advance pointer to store the next instruction
-            if shiftHelper <= 0:
-                self.programMemory.append(instructionTranslated)
-
-                shiftHelper = self.ARCHITECTURE_SIZE
-                instructionTranslated = 0
+            return False
 
-                programMemoryPointer += 1
+        programMemory, error = link([module])
 
-        # If there are any instructions remaining to update, there is probably a syntax error (or a label definition is missing)
-        if instructionUpdate:
-            print("Error [syntax or label definition missing]")
+        if programMemory is None:
+            self._error(error)
 
             return False
 
+        self.programMemory.extend(programMemory)
+
         return True
 
     def _cache(self, pc):
@@ -285,7 +486,7 @@ class VM:
         tag = (pc & 0xFFFFFFF0) >> 4
 
         if line >= len(self.cacheMemory):
-            print("Error when decoding PC... Did you set correctly the size of the cache memory?")
+            self._error("Error when decoding PC... Did you set correctly the size of the cache memory?")
 
             return
 
@@ -293,7 +494,7 @@ class VM:
 
         # Check if cache line is valid or if the tag is different
         if cacheLine.tag is None or cacheLine.tag != tag:
-            print("Miss!")
+            self._log("Miss!")
 
             cacheLine.tag = tag
 
@@ -309,10 +510,72 @@ class VM:
                 cacheLine.block[i] = self.programMemory[index]
 
         else:
-            print("Hit!")
+            self._log("Hit!")
 
         return cacheLine.block[column]
 
+    # Process instructions until the program ends or a quota is exceeded
+    # onStep is called after each processed instruction, onCheck once every quota check interval (and when the run stops)
+    # Returns the reason the run stopped and its statistics
+    def run(self, quota = None, onStep = None, onCheck = None):
+        if quota is None:
+            quota = Quota()
+
+        started = time.monotonic()
+
+        self.outputLimit = quota.outputs
+
+        reason = None
+
+        while reason is None:
+            steps = quota.checkInterval
+
+            # Never process more instructions than the instruction quota allows
+            if quota.instructions is not None:
+                steps = min(steps, quota.instructions - self.instructionCount)
+
+            for i in range(steps):
+                try:
+                    running = self.process()
+                except Exception as error:
+                    # Runtime failure of an instruction (division by zero, invalid register...)
+                    self._error("Error when processing instruction at address " + bin(self.registers[7] - 1) + " (" + type(error).__name__ + ": " + str(error) + ")")
+
+                    running = False
+
+                if not running:
+                    if self.quotaReason is not None:
+                        reason = self.quotaReason
+                    elif self.error is None:
+                        reason = "halted"
+                    else:
+                        reason = "error"
+
+                    break
+
+                if onStep is not None:
+                    onStep()
+            else:
+                reason = quota.exceeded(self, time.monotonic() - started)
+
+            # A run that stopped between checks may still have gone over a quota
+            if reason in ("halted", "error"):
+                reason = quota.exceeded(self, time.monotonic() - started, True) or reason
+
+            if onCheck is not None:
+                onCheck()
+
+        self.stopReason = reason
+
+        return {
+            "reason": reason,
+            "error": self.error,
+            "instructionCount": self.instructionCount,
+            "seconds": time.monotonic() - started,
+            "dataWords": len(self.dataMemory),
+            "outputCount": len(self.outputs)
+        }
+
     # Process machine code
     def process(self):
         
@@ -323,7 +586,7 @@ class VM:
         self.registers[7] += 1
 
         if pc >= len(self.programMemory):
-            print("Reached end of program memory, the application is finalized.")
+            self._log("Reached end of program memory, the application is finalized.")
 
             return False
 
@@ -339,13 +602,15 @@ class VM:
 
         # Invalid op-code
         if not opcode in self.OPCODES_METHOD:
-            print("Error when processing instruction " + bin(instruction) + " at address " + bin(pc) + ", invalid opcode (" + bin(opcode) + ")")
+            self._error("Error when processing instruction " + bin(instruction) + " at address " + bin(pc) + ", invalid opcode (" + bin(opcode) + ")")
 
             return False 
 
         # Get class method corresponding to op-code in order to process the instruction
         processingMethod = self.OPCODES_METHOD[opcode]
 
+        self.instructionCount += 1
+
         # Ignore padding when processing instruction inside method
         if opcode in INSTRUCTION_PADDING:
             shiftHelper -= INSTRUCTION_PADDING[opcode]
@@ -368,7 +633,7 @@ class VM:
         sourceRegister2 = (instruction >> shiftHelper) & 0x07
 
         # destinationRegister = sourceRegister1 + sourceRegister2
-        self.registers[destinationRegister] = self.registers[sourceRegister1] + self.registers[sourceRegister2]
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] + self.registers[sourceRegister2])
 
         return True
 
@@ -388,7 +653,7 @@ class VM:
         immediate = (instruction >> shiftHelper) & 0x3FFFFF
 
         # destinationRegister = sourceRegister1 + immediate
-        self.registers[destinationRegister] = self.registers[sourceRegister1] + immediate
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] + immediate)
 
         return True
 
@@ -408,7 +673,7 @@ class VM:
         sourceRegister2 = instruction & (1 << shiftHelper)
 
         # destinationRegister = sourceRegister1 - sourceRegister2
-        self.registers[destinationRegister] = self.registers[sourceRegister1] - self.registers[sourceRegister2]
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] - self.registers[sourceRegister2])
 
         return True
 
@@ -428,7 +693,7 @@ class VM:
         immediate = (instruction >> shiftHelper) & 0x3FFFFF
 
         # destinationRegister = sourceRegister1 - immediate
-        self.registers[destinationRegister] = self.registers[sourceRegister1] - immediate
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] - immediate)
 
         return True
 
@@ -448,7 +713,7 @@ class VM:
         sourceRegister2 = (instruction >> shiftHelper) & 0x07
 
         # destinationRegister = sourceRegister1 * sourceRegister2
-        self.registers[destinationRegister] = self.registers[sourceRegister1] * self.registers[sourceRegister2]
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] * self.registers[sourceRegister2])
 
         return True
 
@@ -468,7 +733,7 @@ class VM:
         immediate = (instruction >> shiftHelper) & 0x3FFFFF
 
         # destinationRegister = sourceRegister1 * immediate
-        self.registers[destinationRegister] = self.registers[sourceRegister1] * immediate
+        self.registers[destinationRegister] = self._wrap(self.registers[sourceRegister1] * immediate)
 
         return True
 
@@ -488,7 +753,7 @@ class VM:
         sourceRegister2 = (instruction >> shiftHelper) & 0x07
 
         # destinationRegister = sourceRegister1 / sourceRegister2
-        self.registers[destinationRegister] = int(self.registers[sourceRegister1] / self.registers[sourceRegister2])
+        self.registers[destinationRegister] = self._wrap(int(self.registers[sourceRegister1] / self.registers[sourceRegister2]))
 
         return True
 
@@ -508,7 +773,7 @@ class VM:
         immediate = (instruction >> shiftHelper) & 0x3FFFFF
 
         # destinationRegister = sourceRegister1 / immediate
-        self.registers[destinationRegister] = int(self.registers[sourceRegister1] / immediate)
+        self.registers[destinationRegister] = self._wrap(int(self.registers[sourceRegister1] / immediate))
 
         return True
         
@@ -528,6 +793,9 @@ class VM:
         if not address in self.dataMemory:
             self.dataMemory[address] = 0
 
+            # Reading uninitialized memory makes the result depend on the memory default
+            self.deterministic = False
+
         # destinationRegister = value at address (data memory)
         self.registers[destinationRegister] = self.dataMemory[address]
 
@@ -660,21 +928,40 @@ class VM:
         # else error
         if systemCall == 0:    
             try:
-                self.registers[destinationRegister] = int(input())
+                if self.inputs is None:
+                    value = int(input())
+                elif self.inputs:
+                    value = int(self.inputs.pop(0))
+                else:
+                    self._error("Error when processing instruction " + bin(instruction) + ", inout (no input left)")
+
+                    self.inputExhausted = True
+
+                    return False
+
+                self.registers[destinationRegister] = self._wrap(value)
+                self.consumedInputs.append(value)
             except ValueError:
 
                 # Input is not a integer and we are not handling strings
-                print("Error when processing instruction " + bin(instruction) + ", inout (invalid input)")
+                self._error("Error when processing instruction " + bin(instruction) + ", inout (invalid input)")
 
                 return False
 
         elif systemCall == 1:
-            print(self.registers[destinationRegister])
+            if self.outputLimit is not None and len(self.outputs) >= self.outputLimit:
+                self.quotaReason = "outputQuota"
+
+                return False
+
+            self._log(self.registers[destinationRegister])
+
+            self.outputs.append(self.registers[destinationRegister])
 
         else:
 
             # Invalid system call
-            print("Error when processing instruction " + bin(instruction) + ", inout (invalid system call)")
+            self._error("Error when processing instruction " + bin(instruction) + ", inout (invalid system call)")
 
             return False
 
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+from vm_socket import DEFAULT_SOCKET
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run an Inassembly program on the virtual machine daemon")
+    parser.add_argument("source", help = "Inassembly source file (- reads the source code from standard input)")
+    parser.add_argument("inputs", nargs = "*", type = int, help = "Values read by inout")
+    parser.add_argument("--socket", default = DEFAULT_SOCKET, help = "Unix domain socket of the daemon")
+    parser.add_argument("--steps", type = int, help = "Maximum amount of instructions to process")
+    parser.add_argument("--seconds", type = float, help = "Maximum wall time of the run")
+    parser.add_argument("--data-words", type = int, help = "Maximum amount of data memory words touched")
+    parser.add_argument("--outputs", type = int, help = "Maximum amount of values output")
+
+    args = parser.parse_args()
+
+    request = {
+        "inputs": args.inputs,
+        "stepLimit": args.steps,
+        "timeLimit": args.seconds,
+        "dataLimit": args.data_words,
+        "outputLimit": args.outputs
+    }
+
+    if args.source == "-":
+        request["source"] = sys.stdin.read()
+    else:
+        # The daemon may run from another directory
+        request["path"] = os.path.abspath(args.source)
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        client.connect(args.socket)
+    except OSError:
+        client.close()
+
+        print("Error [could not connect to daemon at " + args.socket + "]", file = sys.stderr)
+
+        return 1
+
+    with client, client.makefile("rw") as stream:
+        stream.write(json.dumps(request) + "\n")
+        stream.flush()
+
+        # Outputs are streamed one per line, followed by the result (or an error)
+        for line in stream:
+            message = json.loads(line)
+
+            if message["type"] == "output":
+                print(message["value"])
+
+            elif message["type"] == "error":
+                print(message["message"], file = sys.stderr)
+
+                return 1
+
+            else:
+                print("Stopped (" + message["reason"] + ") after " + str(message["instructionCount"]) + " instructions.", file = sys.stderr)
+
+                if message["error"] is not None:
+                    print(message["error"], file = sys.stderr)
+
+                if message["reason"] != "halted":
+                    return 1
+
+                return 0
+
+    print("Error [daemon closed the connection before sending a result]", file = sys.stderr)
+
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
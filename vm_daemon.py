@@ -0,0 +1,343 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from collections import OrderedDict
+
+from virtual_machine import clearInput, Quota, VM
+from result_cache import ResultCache
+from vm_socket import DEFAULT_SOCKET
+
+# Limits a run is held to when the daemon is started without --max-instructions and --max-seconds
+DEFAULT_MAX_INSTRUCTIONS = 10000000
+DEFAULT_MAX_SECONDS = 10.0
+
+
+# Assembled programs kept in memory, so repeated runs skip clearInput and translate
+class ProgramCache:
+
+    # Default amount of programs kept (least recently used programs are evicted first)
+    CAPACITY = 64
+
+    def __init__(self, capacity = CAPACITY):
+        self.capacity = capacity
+
+        # Source hash -> program memory, ordered from least to most recently used
+        self.programs = OrderedDict()
+
+        self.lock = threading.Lock()
+
+    # Program memory of the source code and its source hash, or None and an error message if it can't be translated
+    def get(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+
+        with self.lock:
+            if key in self.programs:
+                self.programs.move_to_end(key)
+
+                return self.programs[key], key, None
+
+        vm = VM(verbose = False)
+
+        if not vm.translate(clearInput(source)):
+            return None, None, vm.error
+
+        with self.lock:
+            self.programs[key] = vm.programMemory
+
+            while len(self.programs) > self.capacity:
+                self.programs.popitem(last = False)
+
+        return vm.programMemory, key, None
+
+
+# Smallest of two limits, None means unlimited
+def smallestLimit(requested, maximum):
+    if requested is None:
+        return maximum
+
+    if maximum is None:
+        return requested
+
+    return min(requested, maximum)
+
+
+# Remove the socket left behind by a daemon that is no longer running
+# Returns an error message if the path is in use or is not a socket, None otherwise
+def removeStaleSocket(socketPath):
+    try:
+        mode = os.stat(socketPath).st_mode
+    except FileNotFoundError:
+        return None
+
+    if not stat.S_ISSOCK(mode):
+        return "Error [" + socketPath + " exists and is not a socket]"
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        client.connect(socketPath)
+    except ConnectionRefusedError:
+        os.remove(socketPath)
+
+        return None
+    finally:
+        client.close()
+
+    return "Error [a daemon is already listening on " + socketPath + "]"
+
+
+# Error message if the request is malformed, None otherwise
+def validateRequest(request):
+    if not isinstance(request, dict):
+        return "Error [request must be a JSON object]"
+
+    for field in ("source", "path"):
+        if field in request and not isinstance(request[field], str):
+            return "Error [" + field + " must be a string]"
+
+    inputs = request.get("inputs", [])
+
+    if not isinstance(inputs, list) or any(type(value) is not int for value in inputs):
+        return "Error [inputs must be a list of integers]"
+
+    # Counts must be integers, the time limit may be fractional
+    for field, types in (("stepLimit", (int,)), ("timeLimit", (int, float)), ("dataLimit", (int,)), ("outputLimit", (int,))):
+        limit = request.get(field)
+
+        if limit is None:
+            continue
+
+        if type(limit) not in types or limit < 0:
+            return "Error [" + field + " must be a non-negative number]"
+
+    return None
+
+
+# Virtual machines created once and reset between runs
+class VMPool:
+
+    def __init__(self, size):
+        self.available = queue.Queue()
+
+        for i in range(size):
+            self.available.put(VM(verbose = False))
+
+    # Wait for a free virtual machine
+    def acquire(self, inputs):
+        vm = self.available.get()
+
+        vm.reset(inputs)
+
+        return vm
+
+    def release(self, vm):
+        self.available.put(vm)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    # A connection may send any number of requests, one JSON object per line
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.send({"type": "error", "message": "Error [invalid request]"})
+
+                continue
+
+            try:
+                self.server.run(request, self.send)
+            except OSError:
+                # Client went away, nothing left to answer
+                return
+            except Exception as error:
+                self.send({"type": "error", "message": "Error [request failed] " + type(error).__name__ + ": " + str(error)})
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+
+class VMDaemon(socketserver.ThreadingUnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socketPath, workers, resultCache = None, maxQuota = None):
+
+        error = removeStaleSocket(socketPath)
+
+        if error is not None:
+            raise OSError(error)
+
+        super().__init__(socketPath, RequestHandler)
+
+        self.programs = ProgramCache()
+        self.pool = VMPool(workers)
+
+        # Optional cache of recorded results (shared between threads)
+        # Results are identified by the source hash, which already determines the translated program
+        self.resultCache = resultCache
+        self.resultCacheLock = threading.Lock()
+
+        # Limits no request can go over, so a runaway program can't take over a worker
+        self.maxQuota = maxQuota or Quota(DEFAULT_MAX_INSTRUCTIONS, DEFAULT_MAX_SECONDS)
+
+    # Run a request and stream its outputs and result through send
+    def run(self, request, send):
+        error = validateRequest(request)
+
+        if error is not None:
+            send({"type": "error", "message": error})
+
+            return
+
+        if "source" in request:
+            source = request["source"]
+        elif "path" in request:
+            try:
+                with open(request["path"]) as file:
+                    source = file.read()
+            except OSError as error:
+                send({"type": "error", "message": "Error [could not read source file] " + str(error)})
+
+                return
+        else:
+            send({"type": "error", "message": "Error [request has neither path nor source]"})
+
+            return
+
+        inputs = request.get("inputs", [])
+
+        quota = Quota(
+            smallestLimit(request.get("stepLimit"), self.maxQuota.instructions),
+            smallestLimit(request.get("timeLimit"), self.maxQuota.seconds),
+            smallestLimit(request.get("dataLimit"), self.maxQuota.dataWords),
+            smallestLimit(request.get("outputLimit"), self.maxQuota.outputs)
+        )
+
+        programMemory, digest, error = self.programs.get(source)
+
+        if programMemory is None:
+            send({"type": "error", "message": error})
+
+            return
+
+        # Quotas change where a run stops, so they are part of the machine options
+        options = quota.limits()
+
+        if self.resultCache is not None:
+            with self.resultCacheLock:
+                result = self.resultCache.get(programMemory, inputs, options, digest)
+
+            if result is not None:
+                for value in result["outputs"]:
+                    send({"type": "output", "value": value})
+
+                send({
+                    "type": "result",
+                    "reason": result.get("reason"),
+                    "error": result.get("error"),
+                    "registers": result["registers"],
+                    "instructionCount": result["instructionCount"],
+                    "dataWords": result.get("dataWords"),
+                    "outputCount": len(result["outputs"]),
+                    "cached": True
+                })
+
+                return
+
+        vm = self.pool.acquire(inputs)
+
+        try:
+            # Program memory is never changed while processing, so the translated program is shared
+            vm.programMemory = programMemory
+
+            sent = 0
+
+            # Stream outputs produced since the last quota check
+            def streamOutputs():
+                nonlocal sent
+
+                # Never send more values than the output quota allows
+                while sent < len(vm.outputs) and (quota.outputs is None or sent < quota.outputs):
+                    send({"type": "output", "value": vm.outputs[sent]})
+
+                    sent += 1
+
+            stats = vm.run(quota, onCheck = streamOutputs)
+
+            if self.resultCache is not None:
+                with self.resultCacheLock:
+                    self.resultCache.put(programMemory, vm, options, digest)
+
+            send({
+                "type": "result",
+                "reason": stats["reason"],
+                "error": stats["error"],
+                "registers": vm.registers,
+                "instructionCount": stats["instructionCount"],
+                "dataWords": stats["dataWords"],
+                "outputCount": stats["outputCount"],
+                "cached": False
+            })
+        finally:
+            self.pool.release(vm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Inassembly virtual machine daemon")
+    parser.add_argument("--socket", default = DEFAULT_SOCKET, help = "Unix domain socket to listen on")
+    parser.add_argument("--workers", type = int, default = 4, help = "Amount of preinitialized virtual machines")
+    parser.add_argument("--cache", help = "File backing the result cache (no result cache if omitted)")
+    parser.add_argument("--max-instructions", type = int, default = DEFAULT_MAX_INSTRUCTIONS, help = "Most instructions a run may process")
+    parser.add_argument("--max-seconds", type = float, default = DEFAULT_MAX_SECONDS, help = "Most wall time a run may take")
+    parser.add_argument("--max-data-words", type = int, help = "Most data memory words a run may touch")
+    parser.add_argument("--max-outputs", type = int, help = "Most values a run may output")
+
+    args = parser.parse_args()
+
+    resultCache = None
+
+    if args.cache is not None:
+        resultCache = ResultCache(args.cache)
+
+    maxQuota = Quota(args.max_instructions, args.max_seconds, args.max_data_words, args.max_outputs)
+
+    try:
+        server = VMDaemon(args.socket, args.workers, resultCache, maxQuota)
+    except OSError as error:
+        print(error)
+
+        return 1
+
+    print("Listening on " + args.socket + "...")
+
+    # Stop on termination the same way as on interruption, so the result cache is written
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+        os.remove(args.socket)
+
+        if resultCache is not None:
+            resultCache.flush()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# Unix domain socket the daemon listens on when no other path is given
+# Kept apart from vm_daemon so the client starts without importing the virtual machine
+DEFAULT_SOCKET = "/tmp/inassembly-vm.sock"